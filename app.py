@@ -1,10 +1,15 @@
 import os
+import math
 from decimal import Decimal
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from flask_migrate import Migrate
-from models import db, User, FoodItem, MealLog, Meal
+from sqlalchemy import text
+from models import db, User, FoodItem, MealLog, Meal, Goal, DailyTotal
 from utils import smart_search
-from datetime import datetime
+from goals import (apply_log_change, get_goal_progress, evaluate_goals, rebuild_daily_totals,
+                   EVALUATION_BATCH_SIZE, MAX_GOAL_VALUE, MAX_LOG_QUANTITY)
+from datetime import datetime, timedelta
+import click
 
 
 # ----------------- HELPER FUNCTIONS -----------------
@@ -18,6 +23,17 @@ def safe_decimal(value, default=0):
         return Decimal(str(default))
 
 
+def optional_decimal(value):
+    """Like safe_decimal, but blank, invalid or non-finite input means 'not set' (None)."""
+    if value is None or (isinstance(value, str) and value.strip() == ''):
+        return None
+    try:
+        d = Decimal(str(value))
+    except (ArithmeticError, ValueError, TypeError):
+        return None
+    return d if d.is_finite() else None
+
+
 # ----------------- APP CONFIG -----------------
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "fallback_secret")
@@ -30,6 +46,14 @@ db.init_app(app)
 migrate = Migrate(app, db)
 
 
+@app.context_processor
+def inject_goal_progress():
+    """Expose today's goal progress to every template for the logged-in user."""
+    if "user_id" not in session:
+        return {"goal_progress": None}
+    return {"goal_progress": get_goal_progress(session["user_id"], datetime.utcnow().date())}
+
+
 # ----------------- AUTH ROUTES -----------------
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -110,9 +134,10 @@ def delete_log(log_id):
         flash("You must be logged in to delete a log.", "warning")
         return redirect(url_for("login"))
     
-    log = MealLog.query.filter_by(id=log_id, user_id=session["user_id"]).first()
-    if log:
-        db.session.delete(log)
+    # Lock the row so a concurrent delete can't subtract it from the day total twice.
+    log = MealLog.query.filter_by(id=log_id, user_id=session["user_id"]).with_for_update().first()
+    if log and MealLog.query.filter_by(id=log.id).delete() == 1:
+        apply_log_change(log.user_id, log.timestamp, log.food, log.quantity, 0)
         db.session.commit()
         flash("Meal log deleted.", "success")
     else:
@@ -127,6 +152,10 @@ def delete_all_logs():
         flash("You must be logged in to delete logs.", "warning")
         return redirect(url_for("login"))
     
+    # Same lock as rebuild_daily_totals: a concurrent add either commits before both
+    # deletes (and is cleared) or waits and lands afterwards with its total intact.
+    db.session.execute(text("LOCK TABLE daily_totals IN EXCLUSIVE MODE"))
+    DailyTotal.query.filter_by(user_id=session["user_id"]).delete()
     deleted_count = MealLog.query.filter_by(user_id=session["user_id"]).delete()
     db.session.commit()
     flash(f"All {deleted_count} meal logs deleted successfully.", "success")
@@ -143,6 +172,9 @@ def log_meals():
         foodname = request.form["foodname"].strip()
         try:
             quantity = Decimal(request.form["quantity"])
+            if not math.isfinite(quantity) or quantity > MAX_LOG_QUANTITY:
+                flash(f"Quantity must be a number no larger than {MAX_LOG_QUANTITY} g.", "error")
+                return redirect(url_for("log_meals"))
             if quantity <= 0:
                 flash("Quantity must be greater than zero.", "error")
                 return redirect(url_for("log_meals"))
@@ -174,10 +206,12 @@ def log_meals():
         if item and "user_id" in session:
             new_log = MealLog(
                 food_id=item.id,
-                quantity=quantity,
-                user_id=session["user_id"]
+                quantity=float(quantity),
+                user_id=session["user_id"],
+                timestamp=datetime.utcnow()
             )
             db.session.add(new_log)
+            apply_log_change(new_log.user_id, new_log.timestamp, item, 0, new_log.quantity)
             db.session.commit()
 
         return render_template("logmeals.html", item=item, quantity=quantity, searched=searched)
@@ -232,6 +266,69 @@ def meal_details():
         total_fats=round(totals["fats"], 2)
     )
 
+
+# ----------------- GOAL ROUTES -----------------
+@app.route("/setgoals", methods=["GET", "POST"])
+def set_goals():
+    if "user_id" not in session:
+        flash("Please log in to set your goals.", "warning")
+        return redirect(url_for("login"))
+
+    goal = db.session.get(Goal, session["user_id"])
+
+    if request.method == "POST":
+        calories = optional_decimal(request.form.get("calories"))
+        if calories is None or calories <= 0 or calories > MAX_GOAL_VALUE:
+            flash(f"Calorie goal must be a number greater than zero and at most {MAX_GOAL_VALUE}.", "error")
+            return redirect(url_for("set_goals"))
+
+        # A blank macro field clears that goal; anything else must be a valid amount.
+        macros = {}
+        for n in ("protein", "carbs", "fats"):
+            raw = (request.form.get(n) or "").strip()
+            value = optional_decimal(raw)
+            if raw and (value is None or value < 0 or value > MAX_GOAL_VALUE):
+                flash(f"Macro goals must be numbers between 0 and {MAX_GOAL_VALUE}.", "error")
+                return redirect(url_for("set_goals"))
+            macros[n] = value
+
+        if not goal:
+            goal = Goal(user_id=session["user_id"])
+            db.session.add(goal)
+        goal.calories = calories
+        goal.protein = macros["protein"]
+        goal.carbs = macros["carbs"]
+        goal.fats = macros["fats"]
+        db.session.commit()
+        flash("Goals saved!", "success")
+        return redirect(url_for("set_goals"))
+
+    return render_template("setgoals.html", goal=goal)
+
+
+@app.cli.command("evaluate-goals")
+@click.option("--day", default=None, type=click.DateTime(formats=["%Y-%m-%d"]),
+              help="Day to evaluate (YYYY-MM-DD); defaults to yesterday (UTC).")
+@click.option("--batch-size", default=EVALUATION_BATCH_SIZE, show_default=True,
+              type=click.IntRange(min=1), help="Users per set-based batch.")
+def evaluate_goals_command(day, batch_size):
+    """Nightly pass: record every user who missed their goal."""
+    day = day.date() if day else datetime.utcnow().date() - timedelta(days=1)
+
+    stats = evaluate_goals(day, batch_size=batch_size)
+    click.echo(
+        f"{stats['day']}: evaluated {stats['users_evaluated']} users in {stats['batches']} batches, "
+        f"{stats['users_missed']} missed, {stats['seconds']}s ({stats['users_per_second']} users/s)"
+    )
+
+
+@app.cli.command("rebuild-daily-totals")
+def rebuild_daily_totals_command():
+    """Backfill daily_totals from existing meal logs."""
+    rows = rebuild_daily_totals()
+    click.echo(f"Rebuilt {rows} daily totals.")
+
+
 # ----------------- API ROUTES -----------------
 @app.route("/api/users", methods=["GET"])
 def api_get_users():
@@ -343,6 +440,8 @@ def api_add_meal_log():
 
     try:
         quantity = float(data["quantity"])
+        if not math.isfinite(quantity) or quantity > MAX_LOG_QUANTITY:
+            return jsonify({"error": f"Quantity must be a finite number <= {MAX_LOG_QUANTITY}"}), 400
         if quantity <= 0:
             return jsonify({"error": "Quantity must be > 0"}), 400
     except (ValueError, TypeError):
@@ -351,9 +450,11 @@ def api_add_meal_log():
     new_log = MealLog(
         user_id=session["user_id"],
         food_id=food_item.id,
-        quantity=Decimal(str(quantity))
+        quantity=Decimal(str(quantity)),
+        timestamp=datetime.utcnow()
     )
     db.session.add(new_log)
+    apply_log_change(new_log.user_id, new_log.timestamp, food_item, 0, new_log.quantity)
     db.session.commit()
     return jsonify({"message": "Meal logged successfully", "id": new_log.id}), 201
 
@@ -363,11 +464,15 @@ def api_delete_meal_log(log_id):
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    log = MealLog.query.get_or_404(log_id)
+    # Lock the row so a concurrent delete can't subtract it from the day total twice.
+    log = MealLog.query.filter_by(id=log_id).with_for_update().first_or_404()
     if log.user_id != session["user_id"]:
         return jsonify({"error": "Forbidden"}), 403
 
-    db.session.delete(log)
+    if MealLog.query.filter_by(id=log.id).delete() != 1:
+        db.session.rollback()
+        return jsonify({"error": "Meal log not found"}), 404
+    apply_log_change(log.user_id, log.timestamp, log.food, log.quantity, 0)
     db.session.commit()
     return jsonify({"message": "Meal log deleted"}), 200
 
@@ -377,7 +482,8 @@ def api_update_meal_log(log_id):
     if "user_id" not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    log = MealLog.query.get_or_404(log_id)
+    # Lock the row so concurrent updates compute their change from the stored quantity.
+    log = MealLog.query.filter_by(id=log_id).with_for_update().first_or_404()
     if log.user_id != session["user_id"]:
         return jsonify({"error": "Forbidden"}), 403
 
@@ -387,11 +493,14 @@ def api_update_meal_log(log_id):
 
     try:
         quantity = float(data["quantity"])
+        if not math.isfinite(quantity) or quantity > MAX_LOG_QUANTITY:
+            return jsonify({"error": f"Quantity must be a finite number <= {MAX_LOG_QUANTITY}"}), 400
         if quantity <= 0:
             return jsonify({"error": "Quantity must be > 0"}), 400
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid quantity"}), 400
 
+    apply_log_change(log.user_id, log.timestamp, log.food, log.quantity, quantity)
     log.quantity = Decimal(str(quantity))
     db.session.commit()
     return jsonify({"message": "Meal log updated", "id": log.id})
@@ -0,0 +1,174 @@
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Goal, DailyTotal
+
+# A day counts as met when every target that is set lands within this fraction of it.
+GOAL_TOLERANCE = Decimal("0.10")
+
+# Users per nightly batch; bounds transaction size and DB working memory.
+EVALUATION_BATCH_SIZE = 50000
+
+NUTRIENTS = ("calories", "protein", "carbs", "fats")
+
+# Largest value the Numeric(10, 2) goal columns can hold.
+MAX_GOAL_VALUE = Decimal("99999999.99")
+
+# Largest quantity (grams) a single meal log may have. Even at the largest per-100g
+# value food_items can hold, one log then stays within the Numeric(14, 4) totals.
+MAX_LOG_QUANTITY = 5000
+
+# Scale of the daily_totals columns. Each log's contribution is rounded to it
+# exactly as rebuild_daily_totals does, so add/update/delete cancel out exactly.
+TOTAL_PRECISION = Decimal("0.0001")
+
+
+def nutrient_amounts(food, quantity):
+    """Nutrients for `quantity` grams of `food`, as Decimals keyed by nutrient.
+
+    `quantity` should be the value stored in the Float meal_logs.quantity column.
+    It is read with 15 significant digits, as Postgres's CAST(float8 AS NUMERIC)
+    does in rebuild_daily_totals.
+    """
+    q = Decimal(format(float(quantity), ".15g"))
+    return {
+        n: (getattr(food, field) * q / 100).quantize(TOTAL_PRECISION, rounding=ROUND_HALF_UP)
+        for n, field in (("calories", "calories_per_100g"), ("protein", "protein"),
+                         ("carbs", "carbs"), ("fats", "fats"))
+    }
+
+
+def apply_log_change(user_id, logged_at, food, old_quantity, new_quantity):
+    """Move a log entry's contribution to the user's day total from old to new quantity.
+
+    Pass old_quantity=0 for a new log and new_quantity=0 for a deleted one.
+    Logs without a timestamp belong to no day and are skipped, as in rebuild_daily_totals.
+    Uses a single upsert so concurrent writes to the same day cannot lose updates;
+    callers must hold a lock on an existing log row. Caller is responsible for committing.
+    """
+    if logged_at is None:
+        return
+
+    old = nutrient_amounts(food, old_quantity)
+    new = nutrient_amounts(food, new_quantity)
+    amounts = {n: new[n] - old[n] for n in NUTRIENTS}
+    stmt = insert(DailyTotal.__table__).values(user_id=user_id, day=logged_at.date(), **amounts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={n: getattr(DailyTotal.__table__.c, n) + stmt.excluded[n] for n in NUTRIENTS},
+    )
+    db.session.execute(stmt)
+
+
+def get_goal_progress(user_id, day):
+    """Goal vs. logged totals for one user and day: two primary-key lookups, no scans."""
+    goal = db.session.get(Goal, user_id)
+    if not goal:
+        return None
+
+    total = db.session.get(DailyTotal, (user_id, day))
+    progress = {}
+    for n in NUTRIENTS:
+        target = getattr(goal, n)
+        if target is None:
+            continue
+        eaten = float(getattr(total, n)) if total else 0.0
+        progress[n] = {
+            "target": float(target),
+            "eaten": round(eaten, 2),
+            "percent": round(eaten / float(target) * 100, 1) if target else 0.0,
+        }
+    return progress
+
+
+def rebuild_daily_totals():
+    """Recompute daily_totals from meal_logs in one set-based statement.
+
+    Holds an exclusive lock on daily_totals for the duration, so concurrent log
+    writes wait and then apply their change on top of the rebuilt totals.
+    """
+    db.session.execute(text("LOCK TABLE daily_totals IN EXCLUSIVE MODE"))
+    db.session.execute(text("DELETE FROM daily_totals"))
+    result = db.session.execute(text("""
+        INSERT INTO daily_totals (user_id, day, calories, protein, carbs, fats)
+        SELECT m.user_id,
+               CAST(m.timestamp AS DATE),
+               SUM(ROUND(f.calories_per_100g * CAST(m.quantity AS NUMERIC) / 100, 4)),
+               SUM(ROUND(f.protein * CAST(m.quantity AS NUMERIC) / 100, 4)),
+               SUM(ROUND(f.carbs * CAST(m.quantity AS NUMERIC) / 100, 4)),
+               SUM(ROUND(f.fats * CAST(m.quantity AS NUMERIC) / 100, 4))
+        FROM meal_logs m
+        JOIN food_items f ON f.id = m.food_id
+        WHERE m.timestamp IS NOT NULL
+        GROUP BY m.user_id, CAST(m.timestamp AS DATE)
+    """))
+    db.session.commit()
+    return result.rowcount
+
+
+# Each batch evaluates one user_id range inside the database and returns only two
+# counters, so Python memory stays constant regardless of how many users there are.
+_EVALUATE_BATCH_SQL = text("""
+    WITH evaluated AS (
+        SELECT g.user_id,
+               g.calories AS calorie_goal, g.protein AS protein_goal,
+               g.carbs AS carb_goal, g.fats AS fat_goal,
+               COALESCE(t.calories, 0) AS calories, COALESCE(t.protein, 0) AS protein,
+               COALESCE(t.carbs, 0) AS carbs, COALESCE(t.fats, 0) AS fats
+        FROM goals g
+        LEFT JOIN daily_totals t ON t.user_id = g.user_id AND t.day = :day
+        WHERE g.user_id >= :lo AND g.user_id < :hi
+          AND g.created_at < CAST(:day AS DATE) + 1
+    ),
+    missed AS (
+        INSERT INTO goal_misses (user_id, day, calories, protein, carbs, fats)
+        SELECT user_id, :day, calories, protein, carbs, fats
+        FROM evaluated
+        WHERE ABS(calories - calorie_goal) > calorie_goal * :tol
+           OR (protein_goal IS NOT NULL AND ABS(protein - protein_goal) > protein_goal * :tol)
+           OR (carb_goal IS NOT NULL AND ABS(carbs - carb_goal) > carb_goal * :tol)
+           OR (fat_goal IS NOT NULL AND ABS(fats - fat_goal) > fat_goal * :tol)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM evaluated), (SELECT COUNT(*) FROM missed)
+""")
+
+
+def evaluate_goals(day, batch_size=EVALUATION_BATCH_SIZE):
+    """Record every user who missed their goal on `day` into goal_misses.
+
+    Only goals created on or before `day` are checked, against their current
+    targets (goals keep no history). A day with no logs counts as a miss at zero.
+    Walks goals in user_id ranges of `batch_size`, one set-based statement and
+    commit per range. Re-running for the same day replaces earlier results.
+    """
+    started = time.perf_counter()
+
+    db.session.execute(text("DELETE FROM goal_misses WHERE day = :day"), {"day": day})
+    lo, hi = db.session.execute(text("SELECT MIN(user_id), MAX(user_id) FROM goals")).one()
+
+    evaluated = missed = batches = 0
+    if lo is not None:
+        for start in range(lo, hi + 1, batch_size):
+            n_evaluated, n_missed = db.session.execute(_EVALUATE_BATCH_SQL, {
+                "day": day,
+                "lo": start,
+                "hi": start + batch_size,
+                "tol": GOAL_TOLERANCE,
+            }).one()
+            db.session.commit()
+            evaluated += n_evaluated
+            missed += n_missed
+            batches += 1
+    db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "day": day.isoformat(),
+        "users_evaluated": evaluated,
+        "users_missed": missed,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(evaluated / elapsed, 1) if elapsed > 0 else 0.0,
+    }
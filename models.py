@@ -70,5 +70,47 @@ class Meal(db.Model):
     def __repr__(self):
         return f"<Meal {self.id} for {self.user.username}>"
 
+class Goal(db.Model):
+    __tablename__ = "goals"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    calories = db.Column(db.Numeric(10, 2), nullable=False)
+    protein = db.Column(db.Numeric(10, 2))
+    carbs = db.Column(db.Numeric(10, 2))
+    fats = db.Column(db.Numeric(10, 2))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user = db.relationship("User", backref=db.backref("goal", uselist=False))
+
+    def __repr__(self):
+        return f"<Goal {self.calories} kcal for user {self.user_id}>"
+
+class DailyTotal(db.Model):
+    """Running per-day nutrient totals, kept in step with meal_logs on every write."""
+    __tablename__ = "daily_totals"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    calories = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    protein = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    carbs = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+    fats = db.Column(db.Numeric(14, 4), nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<DailyTotal user {self.user_id} on {self.day}>"
+
+class GoalMiss(db.Model):
+    __tablename__ = "goal_misses"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    calories = db.Column(db.Numeric(14, 4), nullable=False)
+    protein = db.Column(db.Numeric(14, 4), nullable=False)
+    carbs = db.Column(db.Numeric(14, 4), nullable=False)
+    fats = db.Column(db.Numeric(14, 4), nullable=False)
+
+    __table_args__ = (db.Index("ix_goal_misses_day", "day"),)
+
+    def __repr__(self):
+        return f"<GoalMiss user {self.user_id} on {self.day}>"
+
 with app.app_context():
     db.create_all()